@@ -7,36 +7,67 @@ import random
 import zipfile
 import threading
 import subprocess
+from functools import lru_cache
+from itertools import islice
 
-from flask import Flask, render_template, jsonify, send_file, request
+import orjson
+import numpy as np
+from flask import Flask, render_template, request, Response, stream_with_context
+from zipstream import ZipStream
 
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
+# Object-oriented matplotlib API: figures built this way never enter
+# pyplot's global figure registry, so repeated /report calls can't leak them.
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.pagesizes import letter
 
-from ecg_core import ECGConfig, ECGState, CARDIAC_EVENTS, SIGNAL_EVENTS
+# Building the sample stylesheet is surprisingly expensive, and it never
+# changes - create it once at import. Paragraph objects themselves are
+# mutated during doc.build, so those stay per-request.
+_PDF_STYLES = getSampleStyleSheet()
+
+
+@lru_cache(maxsize=None)
+def _event_explanation(event_name: str) -> str:
+    return (
+        f"Explanation: This flag indicates {event_name.lower()} was detected in the session. "
+        "Higher percentages suggest more frequent abnormality."
+    )
+
+from ecg_core import ECGConfig, ECGState, CARDIAC_EVENTS, SIGNAL_EVENTS, mask_to_flag_string
 
 try:
     import board
     import busio
     from adafruit_ads1x15.ads1115 import ADS1115
+    from adafruit_ads1x15.ads1x15 import Mode
     from adafruit_ads1x15.analog_in import AnalogIn
     HARDWARE_AVAILABLE = True
 except Exception:
     HARDWARE_AVAILABLE = False
 
+try:
+    # ~10x cheaper acquire/release when uncontended, which this lock almost
+    # always is. Fall back to the stdlib lock where the wheel isn't available.
+    from fastrlock.rlock import FastRLock
+except Exception:
+    FastRLock = threading.Lock
+
 SAMPLE_WINDOW = 5
-RESET_LOCK = threading.Lock()
+RESET_LOCK = FastRLock()
+RESET_EVENT = threading.Event()
 
 app = Flask(__name__)
 
 config = ECGConfig()
 state = ECGState(config)
 
+# ~100 ms of samples per state flush in ecg_loop.
+BATCH_SAMPLES = max(1, config.sample_rate // 10)
+
 
 # ================= HARDWARE / SIM =================
 
@@ -46,6 +77,9 @@ def init_adc():
     try:
         i2c = busio.I2C(board.SCL, board.SDA)
         ads = ADS1115(i2c)
+        # Continuous conversion: reads just fetch the latest result register
+        # instead of triggering and waiting on a single-shot conversion.
+        ads.mode = Mode.CONTINUOUS
         return AnalogIn(ads, 0)
     except Exception:
         return None
@@ -67,33 +101,108 @@ SIMULATE = os.getenv("ECG_SIMULATE", "0") == "1" or not HARDWARE_READY
 # ================= ECG LOOP =================
 
 def ecg_loop():
+    # Lock-free producer: state is only mutated here, so the loop never blocks
+    # on request handlers. Resets are requested via RESET_EVENT and applied
+    # between samples.
+    #
+    # Sleeps target absolute monotonic deadlines rather than a fixed interval,
+    # so processing time and scheduler jitter don't accumulate into sample-rate
+    # drift; after a large overrun the schedule resets instead of spinning to
+    # catch up.
+    #
+    # Samples are collected locally and flushed to state in ~100 ms batches,
+    # so buffer writes and the event detectors run per batch instead of per
+    # sample.
+    period = 1.0 / config.sample_rate
+    next_t = time.monotonic()
+    batch_values: list[int] = []
+    batch_ts: list[float] = []
     while True:
-        with RESET_LOCK:
-            t = time.time()
-            if SIMULATE:
-                val = simulate_sample(t)
-            else:
-                val = chan.value
-            state.add_sample(val, t)
-
-        time.sleep(1 / config.sample_rate)
+        if RESET_EVENT.is_set():
+            state.reset()
+            RESET_EVENT.clear()
+            batch_values.clear()
+            batch_ts.clear()
+
+        t = time.time()
+        if SIMULATE:
+            val = simulate_sample(t)
+        else:
+            val = chan.value
+        batch_values.append(val)
+        batch_ts.append(t)
+        if len(batch_values) >= BATCH_SAMPLES:
+            state.add_samples(batch_values, batch_ts)
+            batch_values = []
+            batch_ts = []
+
+        next_t += period
+        delay = next_t - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        elif delay < -1.0:
+            next_t = time.monotonic()
 
 
 # ================= HELPERS =================
 
-def smooth_series(values: list[int], window: int) -> list[float]:
-    if not values:
-        return []
-    smoothed = []
-    running = 0.0
-    for i, v in enumerate(values):
-        running += v
-        if i >= window:
-            running -= values[i - window]
-            smoothed.append(running / window)
-        else:
-            smoothed.append(running / (i + 1))
-    return smoothed
+def smooth_series(values, window: int) -> np.ndarray:
+    # Moving average via cumulative sums: one vectorized pass instead of a
+    # Python loop over every sample.
+    arr = np.asarray(values, dtype=np.float64)
+    if arr.size == 0:
+        return arr
+    cumsum = np.concatenate(([0.0], np.cumsum(arr)))
+    counts = np.minimum(np.arange(1, arr.size + 1), window)
+    starts = np.maximum(np.arange(arr.size) + 1 - window, 0)
+    return (cumsum[1:] - cumsum[starts]) / counts
+
+
+def json_response(payload) -> Response:
+    # orjson serializes in C and understands NumPy arrays natively, so the
+    # ring-buffer slices go straight out without a tolist() detour.
+    return app.response_class(
+        orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY),
+        mimetype="application/json",
+    )
+
+
+def iter_csv(header: list[str], rows, chunk_rows: int = 4096):
+    # Yields encoded CSV chunks so rows flow straight into the ZIP compressor
+    # instead of materializing the whole file in a StringIO first. writerows
+    # keeps the per-row loop in C.
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, chunk_rows))
+        writer.writerows(batch)
+        yield buf.getvalue().encode("utf-8")
+        if len(batch) < chunk_rows:
+            return
+        buf.seek(0)
+        buf.truncate()
+
+
+# Raw bytes of the (static) software/ tree, keyed by path and validated by
+# mtime/size, so /report doesn't re-read the same files from disk each call.
+_SOFTWARE_CACHE: dict[str, tuple[float, int, bytes]] = {}
+
+
+def software_entries(dirname: str = "software"):
+    for root, _, files in os.walk(dirname):
+        for filename in files:
+            path = os.path.join(root, filename)
+            stat = os.stat(path)
+            cached = _SOFTWARE_CACHE.get(path)
+            if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+                data = cached[2]
+            else:
+                with open(path, "rb") as fh:
+                    data = fh.read()
+                _SOFTWARE_CACHE[path] = (stat.st_mtime, stat.st_size, data)
+            yield path, data
 
 
 def shutdown_allowed(req) -> bool:
@@ -113,34 +222,37 @@ def index():
 
 @app.route("/health")
 def health():
-    with RESET_LOCK:
-        return jsonify({
-            "ok": True,
-            "simulate": SIMULATE,
-            "hardware": HARDWARE_READY,
-            "bpm": state.current_bpm,
-        })
+    return json_response({
+        "ok": True,
+        "simulate": SIMULATE,
+        "hardware": HARDWARE_READY,
+        "bpm": state.current_bpm,
+    })
 
 
 @app.route("/data")
 def data():
-    with RESET_LOCK:
-        ecg_slice = list(state.ecg_data)[-1000:]
-        smoothed = smooth_series(ecg_slice, SAMPLE_WINDOW)
+    # Lock-free: the rings snapshot their write head once per read, so the
+    # sampler never waits on smoothing or JSON encoding here.
+    ecg_slice, _ = state.recent_samples(1000)
+    smoothed = smooth_series(ecg_slice, SAMPLE_WINDOW)
 
-        return jsonify({
-            "ecg": smoothed,
-            "bpm": state.current_bpm,
-            "bpm_history": list(state.bpm_history)[-300:],
-            "events": list(state.event_state.keys()),
-            "signal": {"filtered": list(state.filtered_data)[-1000:]},
-        })
+    return json_response({
+        "ecg": smoothed,
+        "bpm": state.current_bpm,
+        "bpm_history": list(state.bpm_history)[-300:],
+        "events": state.active_cardiac_flags(),
+        "signal": {"filtered": state.filtered_data.tail(1000)},
+    })
 
 
 @app.route("/reset", methods=["POST"])
 def reset():
-    with RESET_LOCK:
+    RESET_EVENT.set()
+    if sampler_thread is None or not sampler_thread.is_alive():
+        # No sampler running to honor the event; reset inline.
         state.reset()
+        RESET_EVENT.clear()
     return ("", 204)
 
 
@@ -155,99 +267,107 @@ def shutdown():
 # ================= REPORT ZIP =================
 @app.route("/report")
 def report():
+    # Keep the lock window O(1): grab the ring head, the small counts dict
+    # and the (short) BPM deques, then do the big buffer copies against the
+    # append-only rings after releasing.
     with RESET_LOCK:
-        ecg_data = list(state.ecg_data)
-        timestamps = list(state.timestamps)
+        head = min(state._ecg_buf.head, state.event_timeline.head)
+        event_counts = state.event_counts
         bpm_history = list(state.bpm_history)
         bpm_timestamps = list(state.bpm_timestamps)
-        event_timeline = list(state.event_timeline)
-        event_counts = dict(state.event_counts)
-
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zipf:
-        ecg_csv = io.StringIO()
-        writer = csv.writer(ecg_csv)
-        writer.writerow(["timestamp", "ecg_value", "cardiac_flags"])
-        for t, v, f in zip(timestamps, ecg_data, event_timeline):
-            writer.writerow([t, v, f])
-        zipf.writestr("ecg_data_with_flags.csv", ecg_csv.getvalue())
-
-        bpm_csv = io.StringIO()
-        writer = csv.writer(bpm_csv)
-        writer.writerow(["timestamp", "bpm"])
-        for t, b in zip(bpm_timestamps, bpm_history):
-            writer.writerow([t, b])
-        zipf.writestr("bpm_data.csv", bpm_csv.getvalue())
-
-        if ecg_data:
-            plt.figure(figsize=(6, 3))
-            plt.plot(ecg_data[-1000:])
-            plt.title("ECG Snapshot")
-            plt.tight_layout()
-            buf = io.BytesIO()
-            plt.savefig(buf, format="png")
-            plt.close()
-            buf.seek(0)
-            zipf.writestr("ecg_snapshot.png", buf.read())
-
-        if bpm_history:
-            plt.figure(figsize=(6, 2))
-            plt.plot(bpm_history[-300:])
-            plt.title("BPM Over Time")
-            plt.tight_layout()
-            buf = io.BytesIO()
-            plt.savefig(buf, format="png")
-            plt.close()
-            buf.seek(0)
-            zipf.writestr("bpm_snapshot.png", buf.read())
-
-        pdf_buf = io.BytesIO()
-        doc = SimpleDocTemplate(pdf_buf, pagesize=letter)
-        styles = getSampleStyleSheet()
-        elements = []
-
-        elements.append(Paragraph("ECG Monitoring Summary", styles["Title"]))
-        elements.append(Spacer(1, 12))
-
-        total = max(sum(event_counts.values()), 1)
-        sorted_events = sorted(event_counts.items(), key=lambda x: x[1], reverse=True)
-
-        for event_name, count in sorted_events:
-            if event_name in CARDIAC_EVENTS or event_name in SIGNAL_EVENTS:
-                pct = (count / total) * 100
-                if pct > 0:
-                    concern = "Normal"
-                    if pct > 20:
-                        concern = "Elevated"
-                    if pct > 40:
-                        concern = "High"
-                    elements.append(Paragraph(f"{event_name}: {pct:.1f}% - {concern}", styles["Normal"]))
-                    elements.append(
-                        Paragraph(
-                            f"Explanation: This flag indicates {event_name.lower()} was detected in the session. "
-                            "Higher percentages suggest more frequent abnormality.",
-                            styles["Italic"],
-                        )
-                    )
-                    elements.append(Spacer(1, 6))
-
-        doc.build(elements)
-        pdf_buf.seek(0)
-        zipf.writestr("report.pdf", pdf_buf.read())
-
-        if os.path.isdir("software"):
-            for root, _, files in os.walk("software"):
-                for filename in files:
-                    path = os.path.join(root, filename)
-                    zipf.write(path, arcname=path)
-
-    zip_buffer.seek(0)
-    return send_file(zip_buffer, download_name="ecg_report_bundle.zip", as_attachment=True)
+
+    ecg_data, timestamps = state.recent_samples(config.ecg_maxlen, head)
+    event_timeline = state.event_timeline.tail(config.ecg_maxlen, head)
+
+    # Stream the archive instead of assembling it in a BytesIO: entries are
+    # deflated on the fly as the client reads, so memory stays flat no matter
+    # how long the session or how big the software tree is. ZIP_STORED is the
+    # default because PNGs and the PDF are already compressed; text entries
+    # opt in to fast DEFLATE per entry.
+    zs = ZipStream(compress_type=zipfile.ZIP_STORED)
+
+    zs.add(
+        iter_csv(
+            ["timestamp", "ecg_value", "cardiac_flags"],
+            zip(timestamps, ecg_data, map(mask_to_flag_string, event_timeline)),
+        ),
+        "ecg_data_with_flags.csv",
+        compress_type=zipfile.ZIP_DEFLATED,
+        compress_level=1,
+    )
+    zs.add(
+        iter_csv(["timestamp", "bpm"], zip(bpm_timestamps, bpm_history)),
+        "bpm_data.csv",
+        compress_type=zipfile.ZIP_DEFLATED,
+        compress_level=1,
+    )
+
+    # Snapshot plots are dashboard thumbnails, not diagnostic traces: every
+    # third point at 72 dpi renders several times faster and produces smaller
+    # PNGs.
+    if len(ecg_data):
+        fig = Figure(figsize=(6, 3), dpi=72)
+        ax = fig.subplots()
+        ax.plot(ecg_data[-1000:][::3], rasterized=True, linewidth=0.5)
+        ax.set_title("ECG Snapshot")
+        fig.tight_layout()
+        buf = io.BytesIO()
+        FigureCanvasAgg(fig).print_png(buf)
+        zs.add(buf.getvalue(), "ecg_snapshot.png")
+
+    if bpm_history:
+        fig = Figure(figsize=(6, 2), dpi=72)
+        ax = fig.subplots()
+        ax.plot(bpm_history[-300:], rasterized=True, linewidth=0.5)
+        ax.set_title("BPM Over Time")
+        fig.tight_layout()
+        buf = io.BytesIO()
+        FigureCanvasAgg(fig).print_png(buf)
+        zs.add(buf.getvalue(), "bpm_snapshot.png")
+
+    pdf_buf = io.BytesIO()
+    doc = SimpleDocTemplate(pdf_buf, pagesize=letter)
+    styles = _PDF_STYLES
+    elements = []
+
+    elements.append(Paragraph("ECG Monitoring Summary", styles["Title"]))
+    elements.append(Spacer(1, 12))
+
+    total = max(sum(event_counts.values()), 1)
+    sorted_events = sorted(event_counts.items(), key=lambda x: x[1], reverse=True)
+
+    for event_name, count in sorted_events:
+        if event_name in CARDIAC_EVENTS or event_name in SIGNAL_EVENTS:
+            pct = (count / total) * 100
+            if pct > 0:
+                concern = "Normal"
+                if pct > 20:
+                    concern = "Elevated"
+                if pct > 40:
+                    concern = "High"
+                elements.append(Paragraph(f"{event_name}: {pct:.1f}% - {concern}", styles["Normal"]))
+                elements.append(Paragraph(_event_explanation(event_name), styles["Italic"]))
+                elements.append(Spacer(1, 6))
+
+    doc.build(elements)
+    zs.add(pdf_buf.getvalue(), "report.pdf")
+
+    if os.path.isdir("software"):
+        for path, data in software_entries():
+            zs.add(data, path, compress_type=zipfile.ZIP_DEFLATED, compress_level=1)
+
+    return Response(
+        stream_with_context(iter(zs)),
+        mimetype="application/zip",
+        headers={"Content-Disposition": "attachment; filename=ecg_report_bundle.zip"},
+    )
 
 
 # ================= START =================
+sampler_thread = None
 if os.getenv("ECG_AUTOSTART", "1") == "1":
-    threading.Thread(target=ecg_loop, daemon=True).start()
+    sampler_thread = threading.Thread(target=ecg_loop, daemon=True)
+    sampler_thread.start()
 
 
 if __name__ == "__main__":
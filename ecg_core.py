@@ -2,9 +2,21 @@ import os
 import time
 import math
 from dataclasses import dataclass, field
-from collections import deque, defaultdict
+from collections import deque
 
-CARDIAC_EVENTS = {
+import numpy as np
+
+try:
+    # Optional JIT for the numeric detector kernel below; the fallback keeps
+    # the same code running as plain Python.
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+CARDIAC_EVENTS = frozenset({
     "Bradycardia",
     "Tachycardia",
     "Ventricular Tachycardia",
@@ -26,15 +38,108 @@ CARDIAC_EVENTS = {
     "Trigeminy (possible)",
     "Frequent Ectopy (possible)",
     "Myocarditis (possible)",
-}
+})
 
-SIGNAL_EVENTS = {
+SIGNAL_EVENTS = frozenset({
     "Low Signal Amplitude",
     "High Noise / Motion Artifact",
     "Baseline Wander",
     "Signal Saturation / Clipping",
     "Lead Off (possible)",
-}
+})
+
+# Fixed bit/index assignment for every known event, so the live flag set can
+# be a single int bitmask and per-event counts a flat array.
+EVENT_NAMES = tuple(sorted(CARDIAC_EVENTS | SIGNAL_EVENTS))
+EVENT_BITS = {name: 1 << i for i, name in enumerate(EVENT_NAMES)}
+EVENT_INDEX = {name: i for i, name in enumerate(EVENT_NAMES)}
+CARDIAC_MASK = sum(EVENT_BITS[name] for name in CARDIAC_EVENTS)
+
+
+def _mask_names(mask: int) -> list[str]:
+    return [name for name, bit in EVENT_BITS.items() if mask & bit]
+
+
+_FLAG_STRINGS: dict[int, str] = {}
+
+
+def mask_to_flag_string(mask: int) -> str:
+    """Comma-joined flag names for a timeline mask, memoized per mask value."""
+    mask = int(mask)
+    cached = _FLAG_STRINGS.get(mask)
+    if cached is None:
+        cached = ",".join(_mask_names(mask))
+        _FLAG_STRINGS[mask] = cached
+    return cached
+
+
+@njit(cache=True)
+def _rr_pattern_flags(recent_rr, mean_rr, short_ratio, long_ratio):
+    """Scan a recent-RR window for ectopy patterns.
+
+    Returns (pvc, pac, bigeminy, trigeminy, ectopy_rate). Deliberately free
+    of dicts and strings so numba can compile it when available; the rest of
+    detect_events stays in Python because event_state bookkeeping is not
+    numeric.
+    """
+    n = recent_rr.shape[0]
+    premature = recent_rr < mean_rr * short_ratio
+    compensatory = recent_rr > mean_rr * long_ratio
+    pvc = False
+    pac = False
+    for i in range(n - 1):
+        if premature[i]:
+            if compensatory[i + 1]:
+                pvc = True
+            else:
+                pac = True
+    bigeminy = n >= 6
+    for i in range(min(n - 1, 5)):
+        if premature[i] == premature[i + 1]:
+            bigeminy = False
+            break
+    trigeminy = n >= 4 and premature[0] and not premature[1] and not premature[2] and premature[3]
+    ectopy_rate = premature.sum() / n if n else 0.0
+    return pvc, pac, bigeminy, trigeminy, ectopy_rate
+
+
+class _Ring:
+    """Preallocated fixed-size ring buffer over a NumPy array.
+
+    Writes bump a monotonically increasing head, so a reader can snapshot the
+    head once and slice a consistent window without locking the writer.
+    """
+
+    __slots__ = ("_buf", "_head")
+
+    def __init__(self, size: int, dtype) -> None:
+        self._buf = np.zeros(size, dtype=dtype)
+        self._head = 0
+
+    def __len__(self) -> int:
+        return min(self._head, self._buf.shape[0])
+
+    @property
+    def head(self) -> int:
+        return self._head
+
+    def append(self, value) -> None:
+        self._buf[self._head % self._buf.shape[0]] = value
+        self._head += 1
+
+    def clear(self) -> None:
+        self._head = 0
+
+    def tail(self, n: int, head: int | None = None) -> np.ndarray:
+        """Copy of the most recent n values, oldest first."""
+        size = self._buf.shape[0]
+        if head is None:
+            head = self._head
+        n = min(n, head, size)
+        start = (head - n) % size
+        if start + n <= size:
+            return self._buf[start : start + n].copy()
+        return np.concatenate((self._buf[start:], self._buf[: n - (size - start)]))
 
 
 @dataclass
@@ -77,20 +182,17 @@ class ECGConfig:
 @dataclass
 class ECGState:
     config: ECGConfig
-    ecg_data: deque = field(init=False)
-    timestamps: deque = field(init=False)
     bpm_history: deque = field(init=False)
     bpm_timestamps: deque = field(init=False)
     rr_intervals: deque = field(init=False)
     qrs_widths: deque = field(init=False)
     qt_intervals: deque = field(init=False)
-    filtered_data: deque = field(init=False)
+    filtered_data: _Ring = field(init=False)
     baseline_window: deque = field(init=False)
     derivative_window: deque = field(init=False)
     premature_flags: deque = field(init=False)
-    event_state: dict = field(default_factory=dict)
-    event_counts: defaultdict = field(default_factory=lambda: defaultdict(int))
-    event_timeline: deque = field(init=False)
+    event_mask: int = 0
+    event_timeline: _Ring = field(init=False)
     current_bpm: int = 0
     last_peak_time: float | None = None
     last_peak_value: int | None = None
@@ -98,33 +200,58 @@ class ECGState:
     last_filtered: float = 0.0
 
     def __post_init__(self) -> None:
-        self.ecg_data = deque(maxlen=self.config.ecg_maxlen)
-        self.timestamps = deque(maxlen=self.config.ecg_maxlen)
+        # Single-producer/single-consumer sample rings: the sampler thread
+        # only writes buffer slots and bumps a monotonically increasing head,
+        # so readers can snapshot without a lock.
+        # int16 matches the ADS1115's 16-bit codes: 2 bytes per sample instead
+        # of a boxed Python int, and better cache locality for the NumPy paths.
+        size = self.config.ecg_maxlen
+        self._ecg_buf = _Ring(size, np.int16)
+        self._ts_buf = _Ring(size, np.float64)
         self.bpm_history = deque(maxlen=self.config.bpm_maxlen)
         self.bpm_timestamps = deque(maxlen=self.config.bpm_maxlen)
         self.rr_intervals = deque(maxlen=self.config.rr_maxlen)
         self.qrs_widths = deque(maxlen=self.config.qrs_maxlen)
         self.qt_intervals = deque(maxlen=self.config.qt_maxlen)
-        self.filtered_data = deque(maxlen=self.config.ecg_maxlen)
+        # Running aggregates over the bounded deques above, adjusted in O(1)
+        # as values enter and leave, so the detectors never re-iterate them.
+        self._rr_diffs = deque(maxlen=max(self.config.rr_maxlen - 1, 1))
+        self._rr_sum = 0.0
+        self._rr_sqsum = 0.0
+        self._rr_diff_sqsum = 0.0
+        self._rr_nn50 = 0
+        self._qrs_sum = 0.0
+        self._qt_sum = 0.0
+        self.filtered_data = _Ring(size, np.float64)
         self.baseline_window = deque(maxlen=self.config.baseline_window_len)
         self.derivative_window = deque(maxlen=self.config.noise_window_len)
         self.premature_flags = deque(maxlen=30)
-        self.event_timeline = deque(maxlen=self.config.ecg_maxlen)
+        self._event_counts = np.zeros(len(EVENT_NAMES), dtype=np.int64)
+        # One mask per sample: an integer store instead of a joined string,
+        # decoded by mask_to_flag_string only at export time.
+        self.event_timeline = _Ring(size, np.uint32)
 
     def reset(self) -> None:
-        self.ecg_data.clear()
-        self.timestamps.clear()
+        self._ecg_buf.clear()
+        self._ts_buf.clear()
         self.bpm_history.clear()
         self.bpm_timestamps.clear()
         self.rr_intervals.clear()
         self.qrs_widths.clear()
         self.qt_intervals.clear()
+        self._rr_diffs.clear()
+        self._rr_sum = 0.0
+        self._rr_sqsum = 0.0
+        self._rr_diff_sqsum = 0.0
+        self._rr_nn50 = 0
+        self._qrs_sum = 0.0
+        self._qt_sum = 0.0
         self.filtered_data.clear()
         self.baseline_window.clear()
         self.derivative_window.clear()
         self.premature_flags.clear()
-        self.event_state.clear()
-        self.event_counts.clear()
+        self.event_mask = 0
+        self._event_counts[:] = 0
         self.event_timeline.clear()
         self.current_bpm = 0
         self.last_peak_time = None
@@ -132,15 +259,77 @@ class ECGState:
         self.last_signal_time = time.time()
         self.last_filtered = 0.0
 
+    def recent_samples(self, n: int, head: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        # Snapshot the value head once and slice both rings against it so the
+        # windows stay paired (timestamps are written before values).
+        if head is None:
+            head = self._ecg_buf.head
+        return self._ecg_buf.tail(n, head), self._ts_buf.tail(n, head)
+
     def set_event(self, name: str, condition: bool) -> None:
+        bit = EVENT_BITS[name]
         if condition:
-            self.event_state[name] = True
-            self.event_counts[name] += 1
+            self._event_counts[EVENT_INDEX[name]] += 1
+            self.event_mask |= bit
         else:
-            self.event_state.pop(name, None)
+            self.event_mask &= ~bit
+
+    @property
+    def event_state(self) -> dict:
+        """Live flags as a dict view; the source of truth is event_mask."""
+        return {name: True for name in _mask_names(self.event_mask)}
+
+    @property
+    def event_counts(self) -> dict[str, int]:
+        """Per-event occurrence counts as a dict view over the counts array."""
+        return {
+            EVENT_NAMES[i]: int(count)
+            for i, count in enumerate(self._event_counts)
+            if count
+        }
 
     def active_flags(self) -> list[str]:
-        return list(self.event_state.keys())
+        return _mask_names(self.event_mask)
+
+    def active_cardiac_flags(self) -> list[str]:
+        return _mask_names(self.event_mask & CARDIAC_MASK)
+
+    @staticmethod
+    def _roll(dq: deque, value: float) -> float | None:
+        """Append to a bounded deque and return the value it evicted, if any."""
+        evicted = dq[0] if len(dq) == dq.maxlen else None
+        dq.append(value)
+        return evicted
+
+    def _append_rr(self, rr: float) -> None:
+        if self.rr_intervals:
+            diff = abs(rr - self.rr_intervals[-1])
+            evicted_diff = self._roll(self._rr_diffs, diff)
+            if evicted_diff is not None:
+                self._rr_diff_sqsum -= evicted_diff * evicted_diff
+                if evicted_diff > 0.05:
+                    self._rr_nn50 -= 1
+            self._rr_diff_sqsum += diff * diff
+            if diff > 0.05:
+                self._rr_nn50 += 1
+        evicted = self._roll(self.rr_intervals, rr)
+        if evicted is not None:
+            self._rr_sum -= evicted
+            self._rr_sqsum -= evicted * evicted
+        self._rr_sum += rr
+        self._rr_sqsum += rr * rr
+
+    def _append_qrs(self, width: float) -> None:
+        evicted = self._roll(self.qrs_widths, width)
+        if evicted is not None:
+            self._qrs_sum -= evicted
+        self._qrs_sum += width
+
+    def _append_qt(self, qt: float) -> None:
+        evicted = self._roll(self.qt_intervals, qt)
+        if evicted is not None:
+            self._qt_sum -= evicted
+        self._qt_sum += qt
 
     def _baseline(self) -> float:
         if not self.baseline_window:
@@ -148,33 +337,34 @@ class ECGState:
         return sum(self.baseline_window) / len(self.baseline_window)
 
     def _compute_rr_stats(self) -> dict:
-        if len(self.rr_intervals) < 2:
+        n = len(self.rr_intervals)
+        if n < 2:
             return {"mean": None, "variance": None, "sdnn": None, "rmssd": None, "pnn50": None}
-        mean_rr = sum(self.rr_intervals) / len(self.rr_intervals)
-        variance = sum((r - mean_rr) ** 2 for r in self.rr_intervals) / len(self.rr_intervals)
+        mean_rr = self._rr_sum / n
+        variance = max(self._rr_sqsum / n - mean_rr * mean_rr, 0.0)
         sdnn = math.sqrt(variance)
-        diffs = [abs(self.rr_intervals[i] - self.rr_intervals[i - 1]) for i in range(1, len(self.rr_intervals))]
-        rmssd = math.sqrt(sum(d * d for d in diffs) / len(diffs)) if diffs else 0.0
-        pnn50 = sum(1 for d in diffs if d > 0.05) / len(diffs) if diffs else 0.0
+        n_diffs = len(self._rr_diffs)
+        rmssd = math.sqrt(max(self._rr_diff_sqsum, 0.0) / n_diffs) if n_diffs else 0.0
+        pnn50 = self._rr_nn50 / n_diffs if n_diffs else 0.0
         return {"mean": mean_rr, "variance": variance, "sdnn": sdnn, "rmssd": rmssd, "pnn50": pnn50}
 
     def _compute_signal_metrics(self) -> dict:
-        window = list(self.filtered_data)[-self.config.noise_window_len :]
-        if len(window) < 5:
+        window = self.filtered_data.tail(self.config.noise_window_len)
+        if window.size < 5:
             return {"range": 0.0, "stdev": 0.0, "deriv": 0.0, "baseline_range": 0.0}
-        mean = sum(window) / len(window)
-        variance = sum((v - mean) ** 2 for v in window) / len(window)
-        stdev = math.sqrt(variance)
-        amp_range = max(window) - min(window)
+        stdev = float(window.std())
+        amp_range = float(window.max() - window.min())
         deriv = sum(self.derivative_window) / len(self.derivative_window) if self.derivative_window else 0.0
         baseline_range = 0.0
         if self.baseline_window:
             baseline_range = max(self.baseline_window) - min(self.baseline_window)
         return {"range": amp_range, "stdev": stdev, "deriv": deriv, "baseline_range": baseline_range}
 
-    def add_sample(self, value: int, t: float) -> None:
-        self.ecg_data.append(value)
-        self.timestamps.append(t)
+    def _ingest(self, value: int, t: float) -> None:
+        self._ts_buf.append(t)
+        # Clamp defensively so a stray out-of-range reading can't overflow
+        # the int16 slot; detection below still sees the raw value.
+        self._ecg_buf.append(min(max(value, -32768), 32767))
 
         self.baseline_window.append(value)
         baseline = self._baseline()
@@ -189,15 +379,15 @@ class ECGState:
             if self.last_peak_time:
                 rr = t - self.last_peak_time
                 if rr > self.config.min_rr_sec:
-                    self.rr_intervals.append(rr)
+                    self._append_rr(rr)
                     bpm = 60 / rr
                     self.current_bpm = int(bpm)
                     self.bpm_history.append(self.current_bpm)
                     self.bpm_timestamps.append(t)
 
-                    self.qt_intervals.append(rr * 0.45)
+                    self._append_qt(rr * 0.45)
                     amplitude = abs(value - self.config.r_threshold)
-                    self.qrs_widths.append(0.08 + amplitude / 100000)
+                    self._append_qrs(0.08 + amplitude / 100000)
 
                     stats = self._compute_rr_stats()
                     mean_rr = stats["mean"] or rr
@@ -209,8 +399,25 @@ class ECGState:
             self.last_peak_time = t
             self.last_signal_time = t
 
+    def add_sample(self, value: int, t: float) -> None:
+        self._ingest(value, t)
         self.detect_events(value, t)
-        self.event_timeline.append(",".join(self.active_flags()))
+        self.event_timeline.append(self.event_mask)
+
+    def add_samples(self, values, ts) -> None:
+        """Ingest a batch of samples, running the event detectors once.
+
+        The timeline still gets one entry per sample so it stays aligned with
+        the value ring; samples within a batch share the post-batch flags.
+        """
+        n = len(values)
+        if not n:
+            return
+        for value, t in zip(values, ts):
+            self._ingest(value, t)
+        self.detect_events(values[-1], ts[-1])
+        for _ in range(n):
+            self.event_timeline.append(self.event_mask)
 
     def detect_events(self, value: int, now: float) -> None:
         self.set_event("Bradycardia", self.current_bpm and self.current_bpm < self.config.brady_bpm)
@@ -257,11 +464,11 @@ class ECGState:
         if len(self.qrs_widths) > 5:
             self.set_event(
                 "Bundle Branch Block (possible)",
-                sum(self.qrs_widths) / len(self.qrs_widths) > 0.14,
+                self._qrs_sum / len(self.qrs_widths) > 0.14,
             )
 
         if len(self.qt_intervals) > 5:
-            avg_qt = sum(self.qt_intervals) / len(self.qt_intervals)
+            avg_qt = self._qt_sum / len(self.qt_intervals)
             self.set_event("Long QT (possible)", avg_qt > 0.48)
             self.set_event("Short QT (possible)", avg_qt < 0.32)
 
@@ -271,33 +478,25 @@ class ECGState:
         )
 
         if len(self.rr_intervals) > 6 and mean_rr:
-            recent_rr = list(self.rr_intervals)[-6:]
-            premature = [rr < mean_rr * self.config.premature_ratio_short for rr in recent_rr]
-            compensatory = [rr > mean_rr * self.config.premature_ratio_long for rr in recent_rr]
-            pvc_like = any(premature[i] and compensatory[i + 1] for i in range(len(premature) - 1))
-            pac_like = any(premature[i] and not compensatory[i + 1] for i in range(len(premature) - 1))
+            recent_rr = np.array(list(self.rr_intervals)[-6:], dtype=np.float64)
+            pvc_like, pac_like, bigeminy, trigeminy, ectopy_rate = _rr_pattern_flags(
+                recent_rr,
+                mean_rr,
+                self.config.premature_ratio_short,
+                self.config.premature_ratio_long,
+            )
             self.set_event("Premature Ventricular Contraction (PVC) (possible)", pvc_like)
             self.set_event("Premature Atrial Contraction (PAC) (possible)", pac_like)
-
-            if len(premature) >= 6:
-                self.set_event(
-                    "Bigeminy (possible)",
-                    all(premature[i] != premature[i + 1] for i in range(5)),
-                )
-                self.set_event(
-                    "Trigeminy (possible)",
-                    premature[0] and not premature[1] and not premature[2] and premature[3],
-                )
-
-            ectopy_rate = sum(premature) / len(premature) if premature else 0.0
+            self.set_event("Bigeminy (possible)", bigeminy)
+            self.set_event("Trigeminy (possible)", trigeminy)
             self.set_event("Frequent Ectopy (possible)", ectopy_rate > 0.2)
 
         myocarditis_score = 0
-        if "Tachycardia" in self.event_state:
+        if self.event_mask & EVENT_BITS["Tachycardia"]:
             myocarditis_score += 1
-        if "Irregular Rhythm" in self.event_state:
+        if self.event_mask & EVENT_BITS["Irregular Rhythm"]:
             myocarditis_score += 1
-        if "Early Repolarization / ST Elevation (possible)" in self.event_state:
+        if self.event_mask & EVENT_BITS["Early Repolarization / ST Elevation (possible)"]:
             myocarditis_score += 1
         self.set_event("Myocarditis (possible)", myocarditis_score >= 2)
 
@@ -308,5 +507,6 @@ class ECGState:
         self.set_event("Signal Saturation / Clipping", value <= self.config.clip_low or value >= self.config.clip_high)
         self.set_event(
             "Lead Off (possible)",
-            metrics["range"] < self.config.low_amp_threshold and "Asystole / Flatline" in self.event_state,
+            metrics["range"] < self.config.low_amp_threshold
+            and bool(self.event_mask & EVENT_BITS["Asystole / Flatline"]),
         )